@@ -1,7 +1,33 @@
+import os
+import tempfile
+import uuid
+from pathlib import Path
+
+# Con cudf instalado (GPU NVIDIA), pandas se acelera en la GPU sin cambios
+# en el código. Debe activarse antes de que se importe pandas.
+try:
+    import cudf.pandas
+
+    cudf.pandas.install()
+except ImportError:
+    pass
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
+import pyarrow.parquet as pq
+
+try:
+    from numba import njit
+except ImportError:  # numba es opcional: sin él se clasifica con NumPy
+    njit = None
+
+try:
+    import numexpr
+except ImportError:  # numexpr es opcional: sin él los rangos se evalúan con NumPy
+    numexpr = None
 
 # -------------------------------------------------------------------
 # 0. CONFIGURACIÓN GENERAL
@@ -15,6 +41,72 @@ st.set_page_config(
 LOGO_LEGAL_PATH = "logo_legal.png"
 LOGO_MUNICIPIO_PATH = "logo_segovia.png"
 
+# Columnas de la hoja MATRIZ que usa el tablero (las demás no se leen)
+SOURCE_COLUMNS = [
+    "NO",
+    "clase",
+    "ESTRATO",
+    "DESTINACION",
+    "avaluo2024",
+    "area_const",
+    "tarifa",
+    "TARIFA PROPUESTA",
+    "VLR_IPU_2025",
+    "IPU LEY 44",
+    "DIFERENCIA EN EL VALOR",
+]
+
+# Columnas que load_data trata como opcionales (ramas `if ... in df.columns`)
+OPTIONAL_SOURCE_COLUMNS = ["NO", "DIFERENCIA EN EL VALOR"]
+
+# Columnas que load_data entrega al tablero (el resto se descarta al cargar)
+DATA_COLUMNS = [
+    "zona",
+    "estrato_cat",
+    "DESTINACION",
+    "avaluo2024",
+    "area_const",
+    "rango_avaluo_2024",
+    "rango_area_const",
+    "VLR_IPU_2025",
+    "IPU LEY 44",
+    "tarifa",
+    "TARIFA PROPUESTA",
+    "cambio_tarifa",
+    "situacion_tarifa",
+    "situacion_ipu",
+]
+
+# Columnas derivadas de pocas categorías que se guardan como categóricas
+CATEGORICAL_COLUMNS = [
+    "zona",
+    "estrato_cat",
+    "DESTINACION",
+    "situacion_tarifa",
+    "situacion_ipu",
+    "rango_avaluo_2024",
+    "rango_area_const",
+]
+
+# Rangos fijos de área construida
+AREA_BINS = np.array([0, 35, 70, 120, np.inf])
+AREA_LABELS = [
+    "0 - 35 m²",
+    "35 - 70 m²",
+    "70 - 120 m²",
+    "Más de 120 m²",
+]
+
+# Dimensiones del cubo de agregados que alimenta las pestañas
+CUBE_KEYS = [
+    "zona",
+    "estrato_cat",
+    "DESTINACION",
+    "rango_avaluo_2024",
+    "rango_area_const",
+    "situacion_tarifa",
+]
+
 # -------------------------------------------------------------------
 # 1. ESTILOS Y ENCABEZADO
 # -------------------------------------------------------------------
@@ -76,94 +168,207 @@ en el impuesto a pagar.
 # -------------------------------------------------------------------
 # 2. CARGA Y PREPARACIÓN DE DATOS
 # -------------------------------------------------------------------
-@st.cache_data
-def load_data(path: str = "MATRIZ PREDIAL_resumida.xlsx") -> pd.DataFrame:
+def formato_miles(valor: float, prefijo: str = "") -> str:
+    """Valor sin decimales con punto como separador de miles (formato es-CO)."""
+    return prefijo + f"{valor:,.0f}".replace(",", ".")
+
+
+def read_matriz(path: str) -> pd.DataFrame:
+    """
+    Lee la hoja MATRIZ desde una copia en Parquet guardada junto al Excel.
+    La copia solo se usa si no es más antigua que el Excel, se puede leer y
+    contiene todas las SOURCE_COLUMNS obligatorias; si no, se lee el Excel y
+    la copia se regenera (se escribe en un temporal y se reemplaza de forma
+    atómica).
+    """
+    xlsx_path = Path(path)
+    parquet_path = xlsx_path.with_suffix(".parquet")
+
+    if parquet_path.exists() and (
+        not xlsx_path.exists()
+        or parquet_path.stat().st_mtime >= xlsx_path.stat().st_mtime
+    ):
+        try:
+            schema = set(pq.read_schema(parquet_path).names)
+            obligatorias = set(SOURCE_COLUMNS) - set(OPTIONAL_SOURCE_COLUMNS)
+            if obligatorias <= schema:
+                return pd.read_parquet(
+                    parquet_path,
+                    engine="pyarrow",
+                    columns=[c for c in SOURCE_COLUMNS if c in schema],
+                )
+        except (OSError, ValueError):
+            # Copia truncada o ilegible (ArrowInvalid es un ValueError)
+            pass
+
+    df = pd.read_excel(
+        xlsx_path, sheet_name="MATRIZ", usecols=lambda c: c in SOURCE_COLUMNS
+    )
+    tmp_path = None
+    try:
+        fd, tmp_name = tempfile.mkstemp(
+            dir=parquet_path.parent, prefix=f".{parquet_path.stem}-", suffix=".parquet"
+        )
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        df.to_parquet(tmp_path, engine="pyarrow", compression="snappy", index=False)
+        # mkstemp crea el archivo con modo 0600; se deja legible como uno normal
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o644 & ~umask)
+        os.replace(tmp_path, parquet_path)
+    except (OSError, ValueError, TypeError):
+        # La copia es opcional: sin permisos de escritura o con columnas que
+        # pyarrow no convierte (ArrowInvalid/ArrowTypeError) se usa el Excel
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+    return df
+
+
+def _codigos_cambio(valores: np.ndarray) -> np.ndarray:
+    """Código int8 por cambio: 0 baja, 1 igual, 2 sube, 3 sin dato (NaN)."""
+    return np.where(np.isnan(valores), 3, np.sign(valores) + 1).astype(np.int8)
+
+
+if njit is not None:
+
+    @njit(cache=True)
+    def _codigo_cambio(x):
+        if np.isnan(x):
+            return 3
+        if x < 0:
+            return 0
+        if x == 0:
+            return 1
+        return 2
+
+    @njit(cache=True)
+    def _clasificar_kernel(tarifa, tarifa_prop, diff_val, out_tarifa, out_ipu):
+        for i in range(tarifa.shape[0]):
+            out_tarifa[i] = _codigo_cambio(tarifa_prop[i] - tarifa[i])
+            out_ipu[i] = _codigo_cambio(diff_val[i])
+
+
+def clasificar_predios(
+    tarifa: pd.Series, tarifa_prop: pd.Series, diferencia: pd.Series
+) -> tuple:
+    """
+    Códigos de situación de la tarifa (propuesta - actual) y del impuesto
+    (diferencia en el valor) con la convención de _codigos_cambio. Con numba
+    instalado ambos se calculan en una sola pasada compilada.
+    """
+    valores = [
+        s.to_numpy(dtype="float64", na_value=np.nan)
+        for s in (tarifa, tarifa_prop, diferencia)
+    ]
+    if njit is None:
+        return _codigos_cambio(valores[1] - valores[0]), _codigos_cambio(valores[2])
+
+    out_tarifa = np.empty(len(valores[0]), dtype=np.int8)
+    out_ipu = np.empty_like(out_tarifa)
+    _clasificar_kernel(*valores, out_tarifa, out_ipu)
+    return out_tarifa, out_ipu
+
+
+def asignar_rangos(
+    valores: pd.Series, bordes: np.ndarray, etiquetas: list
+) -> pd.Categorical:
+    """
+    Asigna cada valor a su rango con np.searchsorted sobre los bordes, igual
+    que pd.cut(..., include_lowest=True): intervalos (a, b], el primero
+    incluye su borde inferior. Fuera de rango o faltante queda como NaN.
+    """
+    x = valores.to_numpy(dtype="float64", na_value=np.nan)
+    codes = np.searchsorted(bordes, x, side="left") - 1
+    codes[x == bordes[0]] = 0
+    codes[(codes < 0) | (codes >= len(etiquetas))] = -1
+    return pd.Categorical.from_codes(codes, categories=etiquetas)
+
+
+@st.cache_resource
+def load_data(path: str = "MATRIZ PREDIAL_resumida.xlsx") -> tuple:
     """
     Lee la hoja MATRIZ, filtra los predios que NO se usan en el análisis
-    y crea columnas derivadas para el tablero.
+    y crea columnas derivadas para el tablero. Devuelve el DataFrame, los
+    límites (mín, máx) de avalúo y área para los sliders del sidebar y un
+    identificador único de esta carga.
+
+    Se cachea como recurso para no copiar el DataFrame en cada rerun: el
+    resultado es compartido entre sesiones y no debe modificarse.
     """
-    df = pd.read_excel(path, sheet_name="MATRIZ")
+    df = read_matriz(path)
 
-    # Excluir predios marcados como NO
+    # Excluir predios marcados como NO (drop ya devuelve un frame nuevo)
     if "NO" in df.columns:
-        df = df[df["NO"] != "NO"].copy()
-    else:
-        df = df.copy()
+        df = df.drop(index=df.index[df["NO"] == "NO"])
 
     # Mapear clase a zona
     df["zona"] = df["clase"].map({1: "URBANO", 2: "RURAL"}).fillna("SIN CLASE")
 
-    # Estrato como texto (0 lo tratamos como "SIN ESTRATO")
-    df["estrato_cat"] = df["ESTRATO"].fillna(0).astype(int).astype(str)
-    df["estrato_cat"] = df["estrato_cat"].replace({"0": "SIN ESTRATO"})
+    # Estrato como categórica: una categoría por estrato presente, con
+    # códigos de searchsorted (0 o faltante lo tratamos como "SIN ESTRATO")
+    valores = df["ESTRATO"].fillna(0).to_numpy().astype(np.int64)
+    presentes = np.unique(valores)
+    estratos = ["SIN ESTRATO" if e == 0 else str(e) for e in presentes]
+    df["estrato_cat"] = pd.Categorical.from_codes(
+        np.searchsorted(presentes, valores), categories=estratos
+    )
 
     # Rangos de avalúo 2024 (en pesos) usando quantiles para ver concentración
     if df["avaluo2024"].notna().sum() > 0:
-        qs = df["avaluo2024"].quantile([0, 0.2, 0.4, 0.6, 0.8, 1]).values
+        avaluo = df["avaluo2024"].to_numpy(dtype="float64", na_value=np.nan)
+        qs = np.nanquantile(avaluo, [0, 0.2, 0.4, 0.6, 0.8, 1])
         # Evitar bins duplicados
         qs = np.unique(qs)
-        labels = []
-        for i in range(len(qs) - 1):
-            labels.append(
-                f"${qs[i]:,.0f} - ${qs[i+1]:,.0f}".replace(",", ".")
-            )
-        df["rango_avaluo_2024"] = pd.cut(
-            df["avaluo2024"],
-            bins=qs,
-            labels=labels,
-            include_lowest=True,
-            duplicates="drop",
-        )
+        labels = [
+            f"{formato_miles(qs[i], '$')} - {formato_miles(qs[i + 1], '$')}"
+            for i in range(len(qs) - 1)
+        ]
+        df["rango_avaluo_2024"] = asignar_rangos(df["avaluo2024"], qs, labels)
     else:
         df["rango_avaluo_2024"] = "SIN AVALUO"
 
     # Rangos de área construida (basado en los cortes típicos 35 y 70 m2)
-    area_bins = [0, 35, 70, 120, np.inf]
-    area_labels = [
-        "0 - 35 m²",
-        "35 - 70 m²",
-        "70 - 120 m²",
-        "Más de 120 m²",
-    ]
-    df["rango_area_const"] = pd.cut(
-        df["area_const"],
-        bins=area_bins,
-        labels=area_labels,
-        include_lowest=True,
-    )
+    df["rango_area_const"] = asignar_rangos(df["area_const"], AREA_BINS, AREA_LABELS)
 
     # Cambio en la TARIFA (milaJe) propuesta vs anterior
     df["cambio_tarifa"] = df["TARIFA PROPUESTA"] - df["tarifa"]
-    df["situacion_tarifa"] = np.select(
-        [
-            df["cambio_tarifa"] < 0,
-            df["cambio_tarifa"] == 0,
-            df["cambio_tarifa"] > 0,
-        ],
-        ["Baja tarifa", "Misma tarifa", "Sube tarifa"],
-        default="Sin dato",
-    )
 
     # Situación del impuesto (comparando valores monetarios)
+    # Se asume DIFERENCIA = IPU_nuevo - IPU_vigente; sin la columna => "Sin dato"
     if "DIFERENCIA EN EL VALOR" in df.columns:
-        # Se asume DIFERENCIA = IPU_nuevo - IPU_vigente
-        df["situacion_ipu"] = np.select(
-            [
-                df["DIFERENCIA EN EL VALOR"] < 0,
-                df["DIFERENCIA EN EL VALOR"] == 0,
-                df["DIFERENCIA EN EL VALOR"] > 0,
-            ],
-            ["Baja IPU", "IPU igual", "Sube IPU"],
-            default="Sin dato",
-        )
+        diferencia = df["DIFERENCIA EN EL VALOR"]
     else:
-        df["situacion_ipu"] = "Sin dato"
+        diferencia = pd.Series(np.nan, index=df.index)
 
-    return df
+    codes_tarifa, codes_ipu = clasificar_predios(
+        df["tarifa"], df["TARIFA PROPUESTA"], diferencia
+    )
+    df["situacion_tarifa"] = pd.Categorical.from_codes(
+        codes_tarifa, categories=["Baja tarifa", "Misma tarifa", "Sube tarifa", "Sin dato"]
+    )
+    df["situacion_ipu"] = pd.Categorical.from_codes(
+        codes_ipu, categories=["Baja IPU", "IPU igual", "Sube IPU", "Sin dato"]
+    )
+
+    # Textos de pocas categorías como categóricas: filtros, groupby y unique
+    # trabajan sobre códigos enteros en vez de objetos Python
+    for col in CATEGORICAL_COLUMNS:
+        df[col] = df[col].astype("category")
+
+    # to_numeric solo baja a float32 cuando no altera los valores
+    for col in ["avaluo2024", "area_const", "VLR_IPU_2025", "IPU LEY 44"]:
+        df[col] = pd.to_numeric(df[col], downcast="float")
+
+    bounds = {
+        "avaluo": (float(df["avaluo2024"].min()), float(df["avaluo2024"].max())),
+        "area": (float(df["area_const"].min()), float(df["area_const"].max())),
+    }
+    return df[DATA_COLUMNS], bounds, uuid.uuid4().hex
 
 
 try:
-    data = load_data()
+    data, bounds, carga_id = load_data()
 except FileNotFoundError:
     st.error(
         "No se encontró el archivo 'MATRIZ PREDIAL_resumida.xlsx' en el directorio. "
@@ -174,20 +379,33 @@ except FileNotFoundError:
 # -------------------------------------------------------------------
 # 3. SIDEBAR (FILTROS)
 # -------------------------------------------------------------------
+@st.cache_data
+def filter_options(_data: pd.DataFrame, carga_id: str) -> dict:
+    """
+    Valores presentes (ordenados) de cada columna con multiselect en el
+    sidebar. Se calculan una vez por carga; `_data` no se hashea y `carga_id`
+    indexa la caché, igual que en filter_positions.
+    """
+    return {
+        col: sorted(_data[col].dropna().unique().tolist())
+        for col in ["zona", "estrato_cat", "DESTINACION"]
+    }
+
+
 st.sidebar.header("Filtros")
+opciones_filtro = filter_options(data, carga_id)
 
-zonas = sorted(data["zona"].dropna().unique().tolist())
+zonas = opciones_filtro["zona"]
 zona_sel = st.sidebar.multiselect("Zona", opciones := zonas, default=zonas)
 
-estratos = sorted(data["estrato_cat"].dropna().unique().tolist())
+estratos = opciones_filtro["estrato_cat"]
 estrato_sel = st.sidebar.multiselect("Estrato", estratos, default=estratos)
 
-destinaciones = sorted(data["DESTINACION"].dropna().unique().tolist())
+destinaciones = opciones_filtro["DESTINACION"]
 dest_sel = st.sidebar.multiselect("Destinación", destinaciones, default=destinaciones)
 
 # Rango de avalúo 2024
-aval_min = float(data["avaluo2024"].min())
-aval_max = float(data["avaluo2024"].max())
+aval_min, aval_max = bounds["avaluo"]
 aval_rango = st.sidebar.slider(
     "Rango de avalúo 2024 (en pesos)",
     min_value=int(aval_min),
@@ -197,8 +415,7 @@ aval_rango = st.sidebar.slider(
 )
 
 # Rango de área construida
-area_min = float(data["area_const"].min())
-area_max = float(data["area_const"].max())
+area_min, area_max = bounds["area"]
 area_rango = st.sidebar.slider(
     "Rango de área construida (m²)",
     min_value=float(int(area_min)),
@@ -206,21 +423,124 @@ area_rango = st.sidebar.slider(
     value=(float(int(area_min)), float(int(area_max))),
 )
 
-# Aplicar filtros
-df_filt = data.copy()
-df_filt = df_filt[df_filt["zona"].isin(zona_sel)]
-df_filt = df_filt[df_filt["estrato_cat"].isin(estrato_sel)]
-df_filt = df_filt[df_filt["DESTINACION"].isin(dest_sel)]
-df_filt = df_filt[
-    (df_filt["avaluo2024"] >= aval_rango[0])
-    & (df_filt["avaluo2024"] <= aval_rango[1])
-]
-df_filt = df_filt[
-    (df_filt["area_const"] >= area_rango[0])
-    & (df_filt["area_const"] <= area_rango[1])
-]
 
-st.sidebar.write(f"Predios filtrados: **{len(df_filt):,}**".replace(",", "."))
+def _isin_codes(serie: pd.Series, seleccion) -> np.ndarray:
+    """Máscara de pertenencia comparando códigos de la categórica, no objetos."""
+    sel_codes = serie.cat.categories.get_indexer(list(seleccion))
+    return np.isin(serie.cat.codes.to_numpy(), sel_codes[sel_codes >= 0])
+
+
+def _en_rangos(
+    avaluo: np.ndarray, area: np.ndarray, aval_rango: tuple, area_rango: tuple
+) -> np.ndarray:
+    """Máscara de los rangos de avalúo y área; con numexpr, en una sola pasada."""
+    aval_lo, aval_hi = aval_rango
+    area_lo, area_hi = area_rango
+    if numexpr is not None:
+        return numexpr.evaluate(
+            "(avaluo >= aval_lo) & (avaluo <= aval_hi)"
+            " & (area >= area_lo) & (area <= area_hi)"
+        )
+    return (avaluo >= aval_lo) & (avaluo <= aval_hi) & (area >= area_lo) & (area <= area_hi)
+
+
+@st.cache_data
+def filter_positions(
+    _data: pd.DataFrame,
+    carga_id: str,
+    zona_sel: tuple,
+    estrato_sel: tuple,
+    dest_sel: tuple,
+    aval_rango: tuple,
+    area_rango: tuple,
+) -> np.ndarray:
+    """
+    Posiciones de los predios que cumplen todos los filtros del sidebar,
+    calculadas con una sola máscara combinada. `_data` no se hashea (es el
+    recurso cacheado por load_data); `carga_id` ata la caché a esa carga, así
+    que una recarga de los datos nunca reutiliza posiciones viejas.
+    """
+    avaluo = _data["avaluo2024"].to_numpy()
+    area = _data["area_const"].to_numpy()
+    mask = np.logical_and.reduce(
+        [
+            _isin_codes(_data["zona"], zona_sel),
+            _isin_codes(_data["estrato_cat"], estrato_sel),
+            _isin_codes(_data["DESTINACION"], dest_sel),
+            _en_rangos(avaluo, area, aval_rango, area_rango),
+        ]
+    )
+    return np.flatnonzero(mask)
+
+
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Resume los predios filtrados en un cubo de sumas y conteos por combinación
+    de categorías. Las agregaciones de las pestañas se hacen sobre el cubo
+    (cientos de filas) en lugar de recorrer todos los predios en cada una.
+    Las tarifas llevan su conteo de valores no nulos para poder promediarlas.
+    """
+    grupos = df.groupby(CUBE_KEYS, observed=True, dropna=False)
+    cube = grupos[["VLR_IPU_2025", "IPU LEY 44", "tarifa", "TARIFA PROPUESTA"]].sum()
+    cube["predios"] = grupos.size()
+    cube["n_tarifa"] = grupos["tarifa"].count()
+    cube["n_tarifa_propuesta"] = grupos["TARIFA PROPUESTA"].count()
+    return cube
+
+
+# Aplicar filtros (tuplas ordenadas: misma selección => misma clave). Las
+# posiciones y el cubo se guardan en la sesión, así que cambiar de pestaña
+# sin tocar los filtros no vuelve a filtrar ni a agregar.
+filt_key = (
+    carga_id,  # invalida las posiciones si los datos se recargan
+    tuple(sorted(zona_sel)),
+    tuple(sorted(estrato_sel)),
+    tuple(sorted(dest_sel)),
+    tuple(aval_rango),
+    tuple(area_rango),
+)
+if st.session_state.get("filt_key") == filt_key:
+    df_filt = data.iloc[st.session_state["filt_idx"]]
+else:
+    filt_idx = filter_positions(data, *filt_key)
+    df_filt = data.iloc[filt_idx]
+    st.session_state["filt_idx"] = filt_idx
+    st.session_state["cube"] = build_cube(df_filt)
+    st.session_state["filt_key"] = filt_key
+cube = st.session_state["cube"]
+
+st.sidebar.write(f"Predios filtrados: **{formato_miles(len(df_filt))}**")
+
+
+def contar_predios(df: pd.DataFrame, col: str) -> pd.DataFrame:
+    """
+    Número de predios por categoría de `col`, en el orden de las categorías.
+    Se omiten los faltantes y las categorías sin predios.
+    """
+    conteo = df[col].value_counts(sort=False, dropna=True)
+    return conteo[conteo > 0].rename_axis(col).reset_index(name="predios")
+
+
+def downsample_scatter(
+    df: pd.DataFrame, x: str, y: str, color: str, max_points: int = 5000
+) -> pd.DataFrame:
+    """
+    Reduce una dispersión a unos `max_points` puntos antes de enviarla a
+    Plotly. Muestrea dentro de cada celda (color, y, 200 tramos de x) para
+    conservar la forma de la nube; toda celda con datos aporta al menos un
+    punto, así que los valores extremos siguen visibles. Se devuelve en el
+    orden original para no alterar el orden de las trazas.
+    """
+    if len(df) <= max_points:
+        return df
+    frac = max_points / len(df)
+    mezcla = df.sample(frac=1, random_state=0)
+    celdas = mezcla.groupby(
+        [mezcla[color], mezcla[y], pd.cut(mezcla[x], 200)], observed=True
+    )
+    cupo = np.ceil(celdas[x].transform("size") * frac)
+    return mezcla[celdas.cumcount() < cupo].sort_index()
+
 
 # -------------------------------------------------------------------
 # 4. TABS PRINCIPALES
@@ -241,42 +561,47 @@ tab_resumen, tab_avaluo, tab_area, tab_estrato, tab_tarifas = st.tabs(
 with tab_resumen:
     st.subheader("Resumen general del impacto en el impuesto")
 
-    total_predios = len(df_filt)
+    # Totales por zona desde el cubo: métricas y barras salen de ~2 filas
+    agg = (
+        cube.groupby(level="zona", observed=True)[
+            ["predios", "VLR_IPU_2025", "IPU LEY 44"]
+        ]
+        .sum()
+        .reset_index()
+    )
+
+    total_predios = int(agg["predios"].sum())
 
-    rec_actual = df_filt["VLR_IPU_2025"].sum()
-    rec_propuesta = df_filt["IPU LEY 44"].sum()
+    rec_actual = agg["VLR_IPU_2025"].sum()
+    rec_propuesta = agg["IPU LEY 44"].sum()
     delta_recaudo = rec_propuesta - rec_actual
 
     col1, col2, col3 = st.columns(3)
-    col1.metric("Predios analizados", f"{total_predios:,}".replace(",", "."))
+    col1.metric("Predios analizados", formato_miles(total_predios))
     col2.metric(
         "Recaudo actual (VLR_IPU_2025)",
-        f"${rec_actual:,.0f}".replace(",", "."),
+        formato_miles(rec_actual, "$"),
     )
     col3.metric(
         "Recaudo propuesto (IPU LEY 44)",
-        f"${rec_propuesta:,.0f}".replace(",", "."),
-        delta=f"${delta_recaudo:,.0f}".replace(",", "."),
+        formato_miles(rec_propuesta, "$"),
+        delta=formato_miles(delta_recaudo, "$"),
     )
 
     # Gráfico de barras: recaudo actual vs propuesto por zona
     st.markdown("#### Recaudo por zona (actual vs propuesto)")
-    agg = (
-        df_filt.groupby("zona")[["VLR_IPU_2025", "IPU LEY 44"]]
-        .sum()
-        .reset_index()
-        .melt(id_vars="zona", var_name="Escenario", value_name="Recaudo")
+    fig_bar = go.Figure(
+        [
+            go.Bar(x=agg["zona"], y=agg[escenario], name=escenario)
+            for escenario in ["VLR_IPU_2025", "IPU LEY 44"]
+        ]
     )
-
-    fig_bar = px.bar(
-        agg,
-        x="zona",
-        y="Recaudo",
-        color="Escenario",
+    fig_bar.update_layout(
         barmode="group",
-        labels={"zona": "Zona", "Recaudo": "Recaudo (COP)"},
+        xaxis_title="Zona",
+        yaxis_title="Recaudo (COP)",
+        legend_title_text="",
     )
-    fig_bar.update_layout(legend_title_text="")
     st.plotly_chart(fig_bar, use_container_width=True)
 
     st.markdown(
@@ -293,22 +618,15 @@ with tab_avaluo:
     st.subheader("Distribución de predios según rangos de avalúo 2024")
 
     # Conteo por rango de avalúo (torta)
-    dist_aval = (
-        df_filt.groupby("rango_avaluo_2024")
-        .size()
-        .reset_index(name="predios")
-        .dropna(subset=["rango_avaluo_2024"])
-    )
+    dist_aval = contar_predios(df_filt, "rango_avaluo_2024")
 
     col_a, col_b = st.columns([2, 1])
 
     with col_a:
-        fig_pie = px.pie(
-            dist_aval,
-            names="rango_avaluo_2024",
-            values="predios",
-            title="Predios por rangos de avalúo 2024",
+        fig_pie = go.Figure(
+            go.Pie(labels=dist_aval["rango_avaluo_2024"], values=dist_aval["predios"])
         )
+        fig_pie.update_layout(title="Predios por rangos de avalúo 2024")
         st.plotly_chart(fig_pie, use_container_width=True)
 
     with col_b:
@@ -329,21 +647,16 @@ lo que ayuda a justificar la necesidad de un esquema tarifario gradual.
 with tab_area:
     st.subheader("Distribución de predios según área construida")
 
-    dist_area = (
-        df_filt.groupby("rango_area_const")
-        .size()
-        .reset_index(name="predios")
-        .dropna(subset=["rango_area_const"])
-    )
+    dist_area = contar_predios(df_filt, "rango_area_const")
 
     col1, col2 = st.columns([2, 1])
 
     with col1:
-        fig_bar_area = px.bar(
-            dist_area,
-            x="rango_area_const",
-            y="predios",
-            labels={"rango_area_const": "Rango de área construida", "predios": "Número de predios"},
+        fig_bar_area = go.Figure(
+            go.Bar(x=dist_area["rango_area_const"], y=dist_area["predios"])
+        )
+        fig_bar_area.update_layout(
+            xaxis_title="Rango de área construida", yaxis_title="Número de predios"
         )
         st.plotly_chart(fig_bar_area, use_container_width=True)
 
@@ -370,7 +683,7 @@ with tab_estrato:
     with col1:
         st.markdown("##### Dispersión avalúo vs estrato")
         fig_scatter_aval = px.scatter(
-            df_filt,
+            downsample_scatter(df_filt, "avaluo2024", "estrato_cat", "zona"),
             x="avaluo2024",
             y="estrato_cat",
             color="zona",
@@ -378,13 +691,14 @@ with tab_estrato:
                 "avaluo2024": "Avalúo 2024 (COP)",
                 "estrato_cat": "Estrato",
             },
+            render_mode="webgl",
         )
         st.plotly_chart(fig_scatter_aval, use_container_width=True)
 
     with col2:
         st.markdown("##### Dispersión área construida vs estrato")
         fig_scatter_area = px.scatter(
-            df_filt,
+            downsample_scatter(df_filt, "area_const", "estrato_cat", "zona"),
             x="area_const",
             y="estrato_cat",
             color="zona",
@@ -392,6 +706,7 @@ with tab_estrato:
                 "area_const": "Área construida (m²)",
                 "estrato_cat": "Estrato",
             },
+            render_mode="webgl",
         )
         st.plotly_chart(fig_scatter_area, use_container_width=True)
 
@@ -411,27 +726,24 @@ with tab_tarifas:
     st.subheader("Comparación de tarifa anterior vs tarifa propuesta")
 
     # Situación de la TARIFA (milaJe)
-    dist_tarifa = (
-        df_filt.groupby("situacion_tarifa")
-        .size()
-        .reset_index(name="predios")
-        .sort_values("predios", ascending=False)
+    dist_tarifa = contar_predios(df_filt, "situacion_tarifa").sort_values(
+        "predios", ascending=False
     )
 
     col1, col2 = st.columns([2, 1])
 
     with col1:
-        fig_tarifa = px.bar(
-            dist_tarifa,
-            x="situacion_tarifa",
-            y="predios",
-            text="predios",
-            labels={
-                "situacion_tarifa": "Situación de la tarifa",
-                "predios": "Número de predios",
-            },
+        fig_tarifa = go.Figure(
+            go.Bar(
+                x=dist_tarifa["situacion_tarifa"],
+                y=dist_tarifa["predios"],
+                text=dist_tarifa["predios"],
+                textposition="outside",
+            )
+        )
+        fig_tarifa.update_layout(
+            xaxis_title="Situación de la tarifa", yaxis_title="Número de predios"
         )
-        fig_tarifa.update_traces(textposition="outside")
         st.plotly_chart(fig_tarifa, use_container_width=True)
 
     with col2:
@@ -451,15 +763,16 @@ del impuesto, que también depende del avalúo y del proindiviso.
 
     st.markdown("##### Tabla resumida de tarifas por zona y destinación")
 
-    resumen_tarifas = (
-        df_filt.groupby(["zona", "DESTINACION"])
-        .agg(
-            predios=("clase", "size"),
-            tarifa_prom_actual=("tarifa", "mean"),
-            tarifa_prom_propuesta=("TARIFA PROPUESTA", "mean"),
-        )
-        .reset_index()
-    )
+    # Promedios como razón de sumas y conteos del cubo (sin recorrer predios)
+    sumas = cube.groupby(level=["zona", "DESTINACION"], observed=True).sum()
+    resumen_tarifas = pd.DataFrame(
+        {
+            "predios": sumas["predios"],
+            "tarifa_prom_actual": sumas["tarifa"] / sumas["n_tarifa"],
+            "tarifa_prom_propuesta": sumas["TARIFA PROPUESTA"]
+            / sumas["n_tarifa_propuesta"],
+        }
+    ).reset_index()
     st.dataframe(resumen_tarifas)
 
     st.markdown(